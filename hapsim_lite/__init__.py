@@ -5,6 +5,14 @@ HapSim Lite
 __author__ = "Solomon M. Adams, PharmD, PhD"
 __version__ = "0.0.1"
 
+import numpy as np
+
+# probability bounds used for clipping, 1 - 1e-9 is not representable in float32 (it rounds to 1).
+# Complements (1 - p) are floored at PROB_MIN directly rather than clipping p at PROB_MAX,
+# which would floor them at the float32 spacing below 1 (~6e-8) instead
+PROB_MIN = np.float32(1e-9)
+PROB_MAX = np.nextafter(np.float32(1), np.float32(0))
+
 VCF_HEADER = """##fileformat=VCFv4.2
 ##source=HapSim_Lite
 ##FILTER=<ID=PASS,Description="All filters passed">
@@ -55,6 +55,16 @@ def main():
             Higher numbers allows for higher contributions of long-distance ld",
         default=7.5,
     )
+    parser.add_argument(
+        "-s", "--seed", type=int, help="Random seed for reproducible output"
+    )
+    parser.add_argument(
+        "-j",
+        "--n-jobs",
+        type=int,
+        help="Number of threads for the Markov-Chain passes, -1 for all available",
+        default=-1,
+    )
     args = parser.parse_args()
 
     logging.basicConfig(stream=sys.stderr, level=logging.INFO)
@@ -70,6 +80,8 @@ def main():
         window=args.ld_window,
         tau=args.t,
         lam=args.d,
+        seed=args.seed,
+        n_jobs=args.n_jobs,
     )
     if args.maf_only:
         logging.info(
@@ -84,5 +96,5 @@ def main():
     call_matrix = generate_call_matrix(
         hap.hap_matrix, args.ploidy, args.num_samples, args.unphased
     )
-    sample_ids = generate_sample_ids(args.num_samples)
+    sample_ids = generate_sample_ids(args.num_samples, args.seed)
     write_vcf(call_matrix, pop_data, sample_ids)
@@ -4,13 +4,21 @@ haplotypes and use a Markov Chain to inject pre-calculated
 LD patterns into data
 """
 
+from typing import Optional
+
 import numpy as np
 import numpy.typing as npt
+from numba import config, get_num_threads, njit, prange, set_num_threads
+from scipy.special import expit  # pylint: disable=no-name-in-module
 
 from .population import PopulationData
+from . import PROB_MIN, PROB_MAX
+
+# number of uniforms drawn at once for a Markov-Chain pass (64MB of float32)
+_UNIFORM_BLOCK_SIZE = 1 << 24
 
 
-class HaplotypeGenerator:
+class HaplotypeGenerator:  # pylint: disable=too-many-instance-attributes
     """Generates simulated haplotypes from minor allele frequencies and
     joint variant probabilities.
 
@@ -23,12 +31,23 @@ class HaplotypeGenerator:
        tau (float): LD signal smoothing hyperparameter, modulates adherence to expected R
        lam (float): decay window, impacts the decay of LD signal as a function of physical distance
        window (int): window size in number of variants around a locus
+       seed (int): seed for the random number generator, for reproducible haplotypes
+       n_jobs (int): number of threads the Markov-Chain passes are split across,
+           capped at the number of threads Numba has available (-1 for all of them)
     """
 
     tau: float
     lam: float
     window: int
+    seed: int | None
+    n_jobs: int
     hap_matrix: npt.NDArray[np.int8]
+    _ctx_left: npt.NDArray[np.int32]
+    _ctx_left_mask: npt.NDArray[np.bool_]
+    _ctx_both: npt.NDArray[np.int32]
+    _ctx_both_mask: npt.NDArray[np.bool_]
+    _w_left: npt.NDArray[np.float32]
+    _w_both: npt.NDArray[np.float32]
 
     def __init__(self, population_data: PopulationData, n_haps: int, **kwargs) -> None:
         """inits HaplotypeGenerator class and sets the initial MAF-weighted haplotypes"""
@@ -37,8 +56,28 @@ class HaplotypeGenerator:
         self.lam = 7.5
         self.tau = 0.3
         self.window = 2
+        self.seed = None
+        self.n_jobs = -1
         for key, value in kwargs.items():
             setattr(self, key, value)
+        if self.n_jobs < 1 and self.n_jobs != -1:
+            raise ValueError(
+                f"n_jobs must be a positive number of threads or -1, got {self.n_jobs}"
+            )
+        self._rng = np.random.default_rng(self.seed)
+        if (
+            self.population_data.prob_band is None
+            or self.population_data.band_window < self.window
+        ):
+            self.population_data.build_prob_band(self.window)
+        self._ctx_left, self._ctx_left_mask = self._get_neighbor_index(
+            self.window, "left"
+        )
+        self._ctx_both, self._ctx_both_mask = self._get_neighbor_index(
+            self.window, "both"
+        )
+        self._w_left = self._get_decay_weights(self._ctx_left, self._ctx_left_mask)
+        self._w_both = self._get_decay_weights(self._ctx_both, self._ctx_both_mask)
         self.init_haplotype()
 
     def init_haplotype(self) -> None:
@@ -46,13 +85,22 @@ class HaplotypeGenerator:
         which may be refined with forward/reverse passes"""
         hap_len: int = self.population_data.mafs.shape[0]
         # initialize 2d array. This is dense, but we will store it with int8 (same size as bool)
-        # for 100000 variants, that is 1kb per haplotype, which should scale okay
-        self.hap_matrix: npt.NDArray[np.int8] = np.zeros(
+        # for 100000 variants, that is 100kb per haplotype, which should scale okay.
+        # Rows are kept unpacked: the Markov passes walk each haplotype row on its own
+        # thread and only ever read a few neighboring bytes, which stay in cache
+        self.hap_matrix: npt.NDArray[np.int8] = np.empty(
             (self.n_haps, hap_len), dtype=np.int8
         )
-        self.hap_matrix[:] = (
-            np.random.rand(self.n_haps, hap_len) < self.population_data.mafs[None, :]
-        ).astype(int)
+        # draw uniforms for a block of haplotypes at a time and write the comparison
+        # straight into hap_matrix (through a bool view) to avoid full-size temporaries
+        step = max(1, _UNIFORM_BLOCK_SIZE // max(1, hap_len))
+        for start in range(0, self.n_haps, step):
+            haps = self.hap_matrix[start : start + step]
+            np.less(
+                self._rng.random(haps.shape, dtype=np.float32),
+                self.population_data.mafs[None, :],
+                out=haps.view(np.bool_),
+            )
 
     def _get_context(self, a: int, window: int, direction: str) -> list[int]:
         """Gets the context window to the left, right, or both"""
@@ -70,44 +118,217 @@ class HaplotypeGenerator:
             case _:
                 raise ValueError(f"Unknown direction: {direction}")
 
-    def get_prob_in_window(self, a: int, context: list[int]) -> npt.NDArray[np.float64]:
-        """For a given window and a target variant, get the P(1|window)"""
-        maf_a = self.population_data.mafs[a].clip(1e-9, 1 - 1e-9)
+    def _get_neighbor_index(
+        self, window: int, direction: str
+    ) -> tuple[npt.NDArray[np.int32], npt.NDArray[np.bool_]]:
+        """Gets the context window of every variant at once as clipped (N, k) neighbor
+        indices and a mask of in-bounds neighbors"""
+        match direction:
+            case "left":
+                offsets = np.arange(-window, 0)
+            case "right":
+                offsets = np.arange(1, window + 1)
+            case "both":
+                offsets = np.concatenate(
+                    [np.arange(-window, 0), np.arange(1, window + 1)]
+                )
+            case _:
+                raise ValueError(f"Unknown direction: {direction}")
+        num_vars = len(self.population_data.mafs)
+        nbr_idx = np.arange(num_vars)[:, None] + offsets[None, :]
+        nbr_valid = (nbr_idx >= 0) & (nbr_idx < num_vars)
+        return nbr_idx.clip(0, num_vars - 1).astype(np.int32), nbr_valid
+
+    def _get_decay_weights(
+        self, nbr_idx: npt.NDArray[np.int32], nbr_valid: npt.NDArray[np.bool_]
+    ) -> npt.NDArray[np.float32]:
+        """Gets the normalized distance decay weights of every variant's context,
+        scaled by tau. Out of bounds neighbors get a weight of 0"""
+        positions = self.population_data.positions
+        pos_deltas = np.abs(positions[nbr_idx] - positions[:, None]).astype(np.float32)
+        weights = np.exp(-(pos_deltas / np.float32(self.lam)))
+        weights *= nbr_valid
+        weights /= weights.sum(axis=1, keepdims=True).clip(PROB_MIN, PROB_MAX)
+        return weights * np.float32(self.tau)
+
+    def get_prob_in_window(
+        self,
+        a: int,
+        context: list[int],
+        weights: Optional[npt.NDArray[np.float32]] = None,
+    ) -> npt.NDArray[np.float32]:
+        """For a given window and a target variant, get the P(1|window).
+
+        weights are the decay weights of the context, normalized and scaled by tau
+        (e.g. a row of _w_left for a row of _ctx_left), and are derived from the
+        variant positions if not given"""
+        maf_a = np.float32(self.population_data.mafs[a]).clip(PROB_MIN, PROB_MAX)
         if len(context) == 0:
             return np.full(self.n_haps, maf_a)
-        cs_selected = self.hap_matrix[:, context]
-        maf_cs = self.population_data.mafs[context]
-        pos_deltas = np.abs(
-            self.population_data.positions[context] - self.population_data.positions[a]
-        )
-        weights = np.exp(-(pos_deltas / self.lam))
-        weights /= weights.sum().clip(1e-9, 1 - 1e-9)
+        if weights is None:
+            pos_deltas = np.abs(
+                self.population_data.positions[context]
+                - self.population_data.positions[a]
+            ).astype(np.float32)
+            weights = np.exp(-(pos_deltas / np.float32(self.lam)))
+            weights /= weights.sum().clip(PROB_MIN, PROB_MAX)
+            weights *= np.float32(self.tau)
         if len(weights) == 0:
             return maf_a
-        pa_cs = self.population_data.prob_matrix[a, context].toarray().ravel()
-        pa_given_cs = (pa_cs / maf_cs).clip(1e-9, 1 - 1e-9)
-        pa_given_ncs = ((maf_a - pa_cs) / (1.0 - maf_cs)).clip(1e-9, 1 - 1e-9)
-        # get the final p for each marker by multiplying selected by cs and not selected by ncs
-        ps = np.where(cs_selected == 1, pa_given_cs, pa_given_ncs).clip(1e-9, 1 - 1e-9)
-        lp1 = (np.log(ps) * weights).sum(axis=1) * self.tau + np.log(maf_a)
-        lp0 = (np.log((1.0 - ps).clip(1e-9, 1 - 1e-9)) * weights).sum(
-            axis=1
-        ) * self.tau + np.log(1.0 - maf_a)
-        p = 1.0 / (1.0 + (np.exp(lp0 - lp1)))
-        return p
+        offsets = np.asarray(context) - a
+        if np.abs(offsets).max() <= self.population_data.band_window:
+            band_cols = offsets + self.population_data.band_window
+            log1_cs = self.population_data.log_pa_given_cs_band[a, band_cols]
+            log1_ncs = self.population_data.log_pa_given_ncs_band[a, band_cols]
+            log0_cs = self.population_data.log_1m_pa_given_cs_band[a, band_cols]
+            log0_ncs = self.population_data.log_1m_pa_given_ncs_band[a, band_cols]
+        else:
+            # context reaches past the precomputed band, fall back to the sparse matrix
+            pa_cs = self.population_data.prob_matrix[a, context].toarray().ravel()
+            log1_cs, log1_ncs, log0_cs, log0_ncs = (
+                self.population_data.conditional_log_proba(a, context, pa_cs)
+            )
+        # each marker only takes one of two values, so weight the logs once per marker
+        # and let the kernel add the cs - ncs difference wherever the context is set
+        w_log1_ncs = log1_ncs * weights
+        w_log0_ncs = log0_ncs * weights
+        return _prob_window(
+            self.hap_matrix,
+            np.asarray(context),
+            log1_cs * weights - w_log1_ncs,
+            w_log1_ncs.sum() + self.population_data.log_mafs[a],
+            log0_cs * weights - w_log0_ncs,
+            w_log0_ncs.sum() + self.population_data.log_1m_mafs[a],
+        )
+
+    def _get_window_terms(self, direction: str) -> tuple[npt.NDArray, ...]:
+        """Gets the haplotype-independent terms of the log-probabilities for every variant.
+
+        Each context term only takes one of two values (pa_given_cs or pa_given_ncs), so
+        lp1 for a haplotype is base1 plus coef1 summed wherever its context is set
+        (and likewise for lp0). Returns the (N, k) neighbor index with coef1, base1,
+        coef0, base0"""
+        match direction:
+            case "left":
+                nbr_idx, weights = self._ctx_left, self._w_left
+            case "both":
+                nbr_idx, weights = self._ctx_both, self._w_both
+            case _:
+                nbr_idx, nbr_valid = self._get_neighbor_index(self.window, direction)
+                weights = self._get_decay_weights(nbr_idx, nbr_valid)
+        # clipped neighbors fall back onto the target itself (offset 0, always in the
+        # band) and carry zero weight
+        var_idx = np.arange(nbr_idx.shape[0])[:, None]
+        band_cols = nbr_idx - var_idx + self.population_data.band_window
+        log1_cs = (
+            self.population_data.log_pa_given_cs_band[var_idx, band_cols] * weights
+        )
+        log1_ncs = (
+            self.population_data.log_pa_given_ncs_band[var_idx, band_cols] * weights
+        )
+        log0_cs = (
+            self.population_data.log_1m_pa_given_cs_band[var_idx, band_cols] * weights
+        )
+        log0_ncs = (
+            self.population_data.log_1m_pa_given_ncs_band[var_idx, band_cols] * weights
+        )
+        coef1 = log1_cs - log1_ncs
+        base1 = log1_ncs.sum(axis=1) + self.population_data.log_mafs
+        coef0 = log0_cs - log0_ncs
+        base0 = log0_ncs.sum(axis=1) + self.population_data.log_1m_mafs
+        return nbr_idx, coef1, base1, coef0, base0
+
+    def _markov_walk(self, variants: npt.NDArray[np.int_], direction: str) -> None:
+        """Runs the Markov-Chain over variants (in order) for every haplotype,
+        splitting the haplotypes across n_jobs threads"""
+        if len(variants) == 0:
+            return
+        terms = self._get_window_terms(direction)
+        # the kernel's threads share hap_matrix and the window terms, and the uniforms
+        # are drawn before it runs, so the haplotypes do not depend on n_jobs
+        n_threads = get_num_threads()
+        if self.n_jobs != -1:
+            max_threads = config.NUMBA_NUM_THREADS  # pylint: disable=no-member
+            set_num_threads(min(self.n_jobs, max_threads))
+        try:
+            # draw the uniforms for a block of haplotypes at a time
+            step = max(1, _UNIFORM_BLOCK_SIZE // len(variants))
+            for start in range(0, self.n_haps, step):
+                haps = self.hap_matrix[start : start + step]
+                uniforms = self._rng.random(
+                    (haps.shape[0], len(variants)), dtype=np.float32
+                )
+                _markov_pass(haps, uniforms, variants, *terms)
+        finally:
+            set_num_threads(n_threads)
 
     def forward_pass(self) -> None:
         """Do a left to right pass, only looking backward (to the left)"""
-        for i in range(1, self.hap_matrix.shape[1] - 1):
-            context = self._get_context(i, self.window, direction="left")
-            p = self.get_prob_in_window(i, context)
-            chosen: npt.NDArray[np.int_] = (np.random.rand(self.n_haps) < p).astype(int)
-            self.hap_matrix[:, i] = chosen
+        self._markov_walk(np.arange(1, self.hap_matrix.shape[1] - 1), "left")
 
     def reverse_pass(self) -> None:
         """Do a right to left pass, looking to the left and right of each target"""
-        for i in reversed(range(0, self.hap_matrix.shape[1] - 1)):
-            context = self._get_context(i, self.window, direction="both")
-            p = self.get_prob_in_window(i, context)
-            chosen: npt.NDArray[np.int_] = (np.random.rand(self.n_haps) < p).astype(int)
-            self.hap_matrix[:, i] = chosen
+        self._markov_walk(np.arange(self.hap_matrix.shape[1] - 2, -1, -1), "both")
+
+    def block_pass(self, direction: str = "both") -> None:
+        """Resample every variant at once from its context window (a block-Gibbs step).
+
+        Unlike forward_pass and reverse_pass, each variant is conditioned on the
+        haplotypes as they were before the pass rather than on the values already
+        drawn for its neighbors during the same pass, which trades the sequential
+        Markov-Chain for a handful of whole-matrix NumPy operations"""
+        nbr_idx, coef1, base1, coef0, base0 = self._get_window_terms(direction)
+        lp1 = np.tile(base1, (self.n_haps, 1))
+        lp0 = np.tile(base0, (self.n_haps, 1))
+        # read one neighbor column per variant at a time rather than gathering the full
+        # (n_haps, N, k) context, which would be k times the size of hap_matrix
+        for k in range(nbr_idx.shape[1]):
+            cs = self.hap_matrix[:, nbr_idx[:, k]]
+            lp1 += cs * coef1[:, k]
+            lp0 += cs * coef0[:, k]
+        p = expit(lp1 - lp0)
+        self.hap_matrix[:] = (
+            self._rng.random(self.hap_matrix.shape, dtype=np.float32) < p
+        )
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _markov_pass(
+    hap_matrix, uniforms, variants, nbr_idx, coef1, base1, coef0, base0
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Resamples the variants in order, each conditioned on the current state of its
+    context (including values drawn earlier in the same pass). Haplotypes are
+    independent given the window terms, so they are walked in parallel."""
+    for h in prange(hap_matrix.shape[0]):  # pylint: disable=not-an-iterable
+        for j, i in enumerate(variants):
+            p = _haplotype_prob(
+                hap_matrix[h], nbr_idx[i], coef1[i], base1[i], coef0[i], base0[i]
+            )
+            hap_matrix[h, i] = uniforms[h, j] < p
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _prob_window(
+    hap_matrix, context, coef1, base1, coef0, base0
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Gets P(1|window) of one variant for every haplotype in a single pass over
+    the context, rather than one NumPy temporary per step"""
+    p = np.empty(hap_matrix.shape[0], dtype=np.float32)
+    for h in prange(hap_matrix.shape[0]):  # pylint: disable=not-an-iterable
+        p[h] = _haplotype_prob(hap_matrix[h], context, coef1, base1, coef0, base0)
+    return p
+
+
+@njit(inline="always", fastmath=True, cache=True)
+def _haplotype_prob(
+    haplotype, context, coef1, base1, coef0, base0
+):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+    """Gets P(1|window) of one variant for one haplotype from the window terms,
+    accumulating both log-probabilities in registers"""
+    lp1 = base1
+    lp0 = base0
+    for k in range(context.shape[0]):
+        if haplotype[context[k]] == 1:
+            lp1 += coef1[k]
+            lp0 += coef0[k]
+    return 1.0 / (1.0 + np.exp(lp0 - lp1))
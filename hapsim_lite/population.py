@@ -4,15 +4,17 @@ MAF and LD data
 """
 
 from typing import Self
-from collections import defaultdict
 
 import numpy as np
 import numpy.typing as npt
+import pandas as pd
 
 from scipy.sparse import csr_matrix
 
+from . import PROB_MIN, PROB_MAX
 
-class PopulationData:  # pylint: disable=too-few-public-methods
+
+class PopulationData:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
     """Parse and store population LD and MAF data
 
     Most efficiently created from Plink2 outputs for
@@ -26,14 +28,29 @@ class PopulationData:  # pylint: disable=too-few-public-methods
         positions (np.array): index-consistent 1d array of variant positions with length N
         prob_matrix (csr_matrix): index-consistent sparse array of P(i,j) values derived from MAF
             and signed R with shape (N, N)
+        prob_band (np.array): dense diagonal band of prob_matrix with shape (N, 2 * band_window + 1)
+            where prob_band[i, j - i + band_window] == prob_matrix[i, j]
+        band_window (int): number of variants on either side of the diagonal held in prob_band
+        log_mafs (np.array): log of the clipped mafs, log_1m_mafs holds log(1 - mafs)
+        log_pa_given_cs_band (np.array): log P(i|j) laid out like prob_band, along with
+            log_pa_given_ncs_band for log P(i|not j) and log_1m_pa_given_cs_band and
+            log_1m_pa_given_ncs_band for their complements
     """
 
     variant_index: dict[str, int]
     variant_info: list[tuple]
-    mafs: npt.NDArray[np.float64]
+    mafs: npt.NDArray[np.float32]
     positions: npt.NDArray[np.int32]
     contigs: set[str]
     prob_matrix: csr_matrix[np.float32]
+    prob_band: npt.NDArray[np.float32]
+    band_window: int
+    log_mafs: npt.NDArray[np.float32]
+    log_1m_mafs: npt.NDArray[np.float32]
+    log_pa_given_cs_band: npt.NDArray[np.float32]
+    log_pa_given_ncs_band: npt.NDArray[np.float32]
+    log_1m_pa_given_cs_band: npt.NDArray[np.float32]
+    log_1m_pa_given_ncs_band: npt.NDArray[np.float32]
 
     def __init__(self, **kwargs) -> None:
         """default init for PopulationData, generally useful for testing only"""
@@ -42,6 +59,14 @@ class PopulationData:  # pylint: disable=too-few-public-methods
         self.mafs = None
         self.positions = None
         self.prob_matrix = None
+        self.prob_band = None
+        self.band_window = None
+        self.log_mafs = None
+        self.log_1m_mafs = None
+        self.log_pa_given_cs_band = None
+        self.log_pa_given_ncs_band = None
+        self.log_1m_pa_given_cs_band = None
+        self.log_1m_pa_given_ncs_band = None
         self.contigs = None
         for key, value in kwargs.items():
             setattr(self, key, value)
@@ -58,39 +83,42 @@ class PopulationData:  # pylint: disable=too-few-public-methods
 
     def _parse_plink2_afreq(self, plink_afreq_path: str) -> None:
         """Parses plink2 afreq output"""
-        self.variant_index = defaultdict(int)
-        self.contigs = set()
-        maf_array = []
-        pos_array = []
-        self.variant_info = []
-        with open(plink_afreq_path, "r", encoding="utf-8") as freq_file:
-            # skip the first (header) row
-            last_pos = 0
-            freq_file.readline()
-            i = 0
-            for row in freq_file:
-                tokens = row.strip().split("\t")
-                var_id = tokens[1]
-                try:
-                    chrom, pos, ref, alt = var_id.split("_")
-                except ValueError:
-                    continue
-                self.contigs.add(chrom)
-                self.variant_info.append((chrom, int(pos), ref, alt))
-                if int(pos) < last_pos:
-                    # happens if it is not sorted
-                    raise ValueError("Plink Input files are not sorted by position!")
-                last_pos = int(pos)
-                maf = float(tokens[4])
-                self.variant_index[var_id] = i
-                maf_array.append(maf)
-                pos_array.append(pos)
-                i += 1
-        self.mafs = np.array(maf_array, dtype=np.float32).clip(1e-9, 1 - 1e-9)
-        self.positions = np.array(pos_array, dtype=np.int32)
-
-    def _derive_joint_proba(self, a: int, b: int, r_signed: float) -> float:
-        """Uses MAFs for 2 variants (a and b) and their R value to derive P(a,b)"""
+        # only the ID (1) and ALT_FREQS (4) columns are needed
+        freq = pd.read_csv(
+            plink_afreq_path,
+            sep="\t",
+            usecols=[1, 4],
+            dtype={1: str},
+            na_filter=False,
+            memory_map=True,
+        )
+        var_ids = freq.iloc[:, 0]
+        # skip variants without a chrom_pos_ref_alt ID
+        is_valid = var_ids.str.count("_") == 3
+        if not is_valid.any():
+            raise ValueError(
+                "No variant IDs in the Plink afreq file are formatted as chrom_pos_ref_alt!"
+            )
+        var_ids = var_ids[is_valid]
+        id_parts = var_ids.str.split("_", expand=True)
+        chrom, pos, ref, alt = id_parts[0], id_parts[1], id_parts[2], id_parts[3]
+        self.positions = pos.to_numpy(dtype=np.int32)
+        if np.any(np.diff(self.positions) < 0):
+            # happens if it is not sorted
+            raise ValueError("Plink Input files are not sorted by position!")
+        self.contigs = set(chrom)
+        self.variant_info = list(zip(chrom, self.positions.tolist(), ref, alt))
+        self.variant_index = dict(zip(var_ids, range(len(var_ids))))
+        self.mafs = (
+            freq.iloc[:, 1][is_valid]
+            .to_numpy(dtype=np.float32)
+            .clip(PROB_MIN, PROB_MAX)
+        )
+
+    def _derive_joint_proba(
+        self, a: npt.NDArray[np.int_], b: npt.NDArray[np.int_], r_signed: npt.NDArray
+    ) -> npt.NDArray[np.float32]:
+        """Uses MAFs for variant pairs (a and b) and their R values to derive P(a,b)"""
         maf_a = self.mafs[a]
         maf_b = self.mafs[b]
         s = np.sqrt(maf_a * (1.0 - maf_a) * maf_b * (1.0 - maf_b))
@@ -98,29 +126,88 @@ class PopulationData:  # pylint: disable=too-few-public-methods
 
     def _parse_plink2_vcor(self, plink_vcor_path: str) -> None:
         """Parses plink vcor file to csr_matrix"""
-        # initialize the frequency matrix
-        # ld_csr = csr_matrix((num_vars, num_vars), dtype = np.float32)
-        ld_data = []
-        ld_rows = []
-        ld_columns = []
-        with open(plink_vcor_path, "r", encoding="utf-8") as ld_file:
-            # skip header
-            ld_file.readline()
-            for row in ld_file:
-                tokens = row.strip().split("\t")
-                var_id_a_address = self.variant_index[tokens[2]]
-                var_id_b_address = self.variant_index[tokens[6]]
-                pa_b = self._derive_joint_proba(
-                    var_id_a_address, var_id_b_address, float(tokens[8])
-                )
-                # set both sides of the matrix with the batch
-                # so we don't have to manually mirror
-                ld_data += [pa_b, pa_b]
-                ld_rows += [var_id_a_address, var_id_b_address]
-                ld_columns += [var_id_b_address, var_id_a_address]
+        # only the ID_A (2), ID_B (6) and R (8) columns are needed
+        ld = pd.read_csv(
+            plink_vcor_path,
+            sep="\t",
+            usecols=[2, 6, 8],
+            na_filter=False,
+            memory_map=True,
+        )
+        var_id_a_address = ld.iloc[:, 0].map(self.variant_index)
+        var_id_b_address = ld.iloc[:, 1].map(self.variant_index)
+        # skip pairs with a variant that is not in the afreq file
+        is_known = var_id_a_address.notna() & var_id_b_address.notna()
+        var_id_a_address = var_id_a_address[is_known].to_numpy(dtype=np.int32)
+        var_id_b_address = var_id_b_address[is_known].to_numpy(dtype=np.int32)
+        pa_b = self._derive_joint_proba(
+            var_id_a_address,
+            var_id_b_address,
+            ld.iloc[:, 2][is_known].to_numpy(dtype=np.float32),
+        )
+        # set both sides of the matrix at once so we don't have to manually mirror,
+        # writing straight into the COO buffers the csr_matrix is built from
+        num_pairs = len(pa_b)
+        ld_data = np.empty(2 * num_pairs, dtype=np.float32)
+        ld_rows = np.empty(2 * num_pairs, dtype=np.int32)
+        ld_columns = np.empty(2 * num_pairs, dtype=np.int32)
+        ld_data[:num_pairs] = pa_b
+        ld_data[num_pairs:] = pa_b
+        ld_rows[:num_pairs] = var_id_a_address
+        ld_rows[num_pairs:] = var_id_b_address
+        ld_columns[:num_pairs] = var_id_b_address
+        ld_columns[num_pairs:] = var_id_a_address
         num_vars = len(self.mafs)
         self.prob_matrix = csr_matrix(
             (ld_data, (ld_rows, ld_columns)),
             shape=(num_vars, num_vars),
             dtype=np.float32,
         )
+
+    def conditional_log_proba(
+        self, a: int | npt.NDArray[np.int_], b: npt.NDArray[np.int_], pa_b: npt.NDArray
+    ) -> tuple[npt.NDArray[np.float32], ...]:
+        """Uses MAFs for variants a and b and P(a,b) to derive the clipped logs of
+        P(a|b), P(a|not b), 1 - P(a|b) and 1 - P(a|not b)"""
+        maf_a = self.mafs[a].astype(np.float32).clip(PROB_MIN, PROB_MAX)
+        maf_b = self.mafs[b].astype(np.float32).clip(PROB_MIN, PROB_MAX)
+        # conditionals may saturate at 1 (variants in perfect LD), the complements
+        # are floored on their own so they bottom out at PROB_MIN rather than at
+        # the float32 spacing below 1
+        pa_given_b = (pa_b / maf_b).clip(PROB_MIN, 1.0)
+        pa_given_nb = ((maf_a - pa_b) / (1.0 - maf_b)).clip(PROB_MIN, 1.0)
+        return (
+            np.log(pa_given_b),
+            np.log(pa_given_nb),
+            np.log(np.maximum(1.0 - pa_given_b, PROB_MIN)),
+            np.log(np.maximum(1.0 - pa_given_nb, PROB_MIN)),
+        )
+
+    def build_prob_band(self, window: int) -> None:
+        """Densifies the diagonal band of prob_matrix within window variants of each
+        variant so that context lookups are plain array indexing, and precomputes
+        the log-probability tables used by the Markov-Chain"""
+        num_vars = len(self.mafs)
+        self.prob_band = np.zeros((num_vars, 2 * window + 1), dtype=np.float32)
+        ld_coo = self.prob_matrix.tocoo()
+        offsets = ld_coo.col.astype(np.int64) - ld_coo.row
+        in_band = np.abs(offsets) <= window
+        self.prob_band[ld_coo.row[in_band], offsets[in_band] + window] = ld_coo.data[
+            in_band
+        ]
+        self.band_window = window
+        mafs = self.mafs.astype(np.float32).clip(PROB_MIN, PROB_MAX)
+        self.log_mafs = np.log(mafs)
+        self.log_1m_mafs = np.log(np.maximum(1.0 - mafs, PROB_MIN))
+        # neighbors past either end of the chromosome are clipped, their values are
+        # placeholders and should never be given any weight
+        var_idx = np.arange(num_vars)[:, None]
+        nbr_idx = (var_idx + np.arange(-window, window + 1)[None, :]).clip(
+            0, num_vars - 1
+        )
+        (
+            self.log_pa_given_cs_band,
+            self.log_pa_given_ncs_band,
+            self.log_1m_pa_given_cs_band,
+            self.log_1m_pa_given_ncs_band,
+        ) = self.conditional_log_proba(var_idx, nbr_idx, self.prob_band)
@@ -6,59 +6,110 @@ This approach has fewer guardrails than using pysam to generate and write the VC
 but it is orders-of-magnitude faster.
 """
 
-import uuid
+import secrets
+import sys
 
 from typing import Optional
-from itertools import product
 import numpy as np
 
 from .population import PopulationData
 from . import VCF_HEADER
 
+# bytes of calls laid out at once when writing a chunk of VCF rows (16MB)
+_CHUNK_BYTES = 1 << 24
+
 
 def _make_contig_row(contig: str, length: Optional[str] = None) -> str:
     """For a given contig, generate the VCF header row with optional length"""
     return f"##contig=<ID={contig}{',length=' + length if length is not None else ''}>"
 
 
-def generate_sample_ids(n_samples: int) -> list[str]:
-    """Generates a list of random sample IDs"""
-    return [uuid.uuid4().hex[0:10] for i in range(0, n_samples)]
+def generate_sample_ids(n_samples: int, seed: Optional[int] = None) -> list[str]:
+    """Generates a list of random 10 character hex sample IDs,
+    drawn from a seeded generator if a seed is given"""
+    # draw the random bytes for every ID at once rather than one urandom call per ID
+    if seed is None:
+        raw = secrets.token_bytes(5 * n_samples).hex()
+    else:
+        raw = np.random.default_rng(seed).bytes(5 * n_samples).hex()
+    return [raw[i : i + 10] for i in range(0, 10 * n_samples, 10)]
 
 
 def generate_call_matrix(
     haplotype_matrix: np.array, ploidy: int, num_samples: int, unphased: bool
 ) -> np.array:
     """Reshape simulated haplotypes according to ploidy and sample count,
-    returning GT strings for each variant."""
-    # reshape to (samples, ploidy, variants)
-    gt_shaped = haplotype_matrix.reshape(num_samples, ploidy, haplotype_matrix.shape[1])
-    # compute genotype indices
-    powers = 2 ** np.arange(ploidy)[::-1]  # [2^(p-1), ..., 1]
-    # get the dot product the powers and gt reshaped, which will map to the string GT later
-    gt_calls = np.tensordot(
-        gt_shaped, powers, axes=([1], [0])
-    )  # shape (samples, variants)
-    # choose separator and lookup
+    returning GT byte strings for each variant."""
     gt_delim = "/" if unphased else "|"
-    lookup = np.array([gt_delim.join(i) for i in product(["0", "1"], repeat=ploidy)])
-    return lookup[gt_calls]
+    num_vars = haplotype_matrix.shape[1]
+    # reshape to (samples, ploidy, variants)
+    gt_shaped = haplotype_matrix.reshape(num_samples, ploidy, num_vars)
+    # write the ASCII bytes of each call directly into a contiguous
+    # (samples, variants, 2 * ploidy - 1) buffer, alleles at even offsets and
+    # delimiters between them, and reinterpret each call as one fixed-width string
+    calls = np.empty((num_samples, num_vars, 2 * ploidy - 1), dtype=np.uint8)
+    calls[..., 1::2] = ord(gt_delim)
+    for i in range(ploidy):
+        calls[..., 2 * i] = gt_shaped[:, i, :] + ord("0")
+    return calls.view(f"S{2 * ploidy - 1}").reshape(num_samples, num_vars)
+
+
+def _make_variant_row(chrom: str, pos: int, ref: str, alt: str) -> bytes:
+    """For a given variant, generate the fixed VCF columns up to and including FORMAT"""
+    return f"{chrom}\t{pos}\t{chrom}_{pos}_{ref}_{alt}\t{ref}\t{alt}\t.\t.\t.\tGT\t".encode()
+
+
+def _make_gt_rows(gt_chunk: np.array) -> np.array:
+    """For a (samples, variants) chunk of fixed-width byte calls, lay the calls out as
+    the raw bytes of each variant's row, with a tab after every call and a newline
+    after the last sample"""
+    num_samples, num_vars = gt_chunk.shape
+    gt_width = gt_chunk.dtype.itemsize
+    gt_bytes = np.empty((num_vars, num_samples, gt_width + 1), dtype=np.uint8)
+    gt_bytes[..., :gt_width] = (
+        np.ascontiguousarray(gt_chunk.T)
+        .view(np.uint8)
+        .reshape(num_vars, num_samples, gt_width)
+    )
+    gt_bytes[..., gt_width] = ord("\t")
+    gt_bytes[:, -1, gt_width] = ord("\n")
+    return gt_bytes
 
 
 def write_vcf(
-    gt_matrix: np.array, population_data: PopulationData, sample_ids: list[str]
+    gt_matrix: np.array,
+    population_data: PopulationData,
+    sample_ids: list[str],
+    chunk_size: Optional[int] = None,
 ) -> None:
     """Writes a VCF to stdout so it can be sorted/bgzipped by bcftools
-    (or written to uncompressed VCF)"""
-    # slice haplotype matrix into sets of 2 rows
+    (or written to uncompressed VCF).
+
+    Rows are written chunk_size variants at a time, by default as many variants
+    as fit in _CHUNK_BYTES of calls"""
+    if gt_matrix.dtype.kind == "U":
+        # calls are plain ASCII, so encode them to one byte per character
+        gt_matrix = np.char.encode(gt_matrix, "ascii")
+    elif gt_matrix.dtype.kind != "S":
+        raise ValueError(f"GT calls must be byte strings, got {gt_matrix.dtype}")
+    out = sys.stdout.buffer
     contig_rows = []
     for contig in population_data.contigs:
         contig_rows.append(_make_contig_row(contig))
     samples = "\t".join(sample_ids)
     header = VCF_HEADER.format(contigs="\n".join(contig_rows), samples=samples)
-    print(header)
-    for i, (chrom, pos, ref, alt) in enumerate(population_data.variant_info):
-        gt = "\t".join(gt_matrix[:, i])
-        print(
-            f"{chrom}\t{pos}\t{chrom}_{pos}_{ref}_{alt}\t{ref}\t{alt}\t.\t.\t.\tGT\t{gt}"
-        )
+    out.write(header.encode() + b"\n")
+    if chunk_size is None:
+        row_bytes = gt_matrix.shape[0] * (gt_matrix.dtype.itemsize + 1)
+        chunk_size = max(1, _CHUNK_BYTES // row_bytes)
+    for start in range(0, gt_matrix.shape[1], chunk_size):
+        gt_bytes = _make_gt_rows(gt_matrix[:, start : start + chunk_size])
+        rows = []
+        for i, info in enumerate(
+            population_data.variant_info[start : start + chunk_size]
+        ):
+            rows.append(_make_variant_row(*info))
+            # hand the row's buffer over as is rather than copying it out
+            rows.append(gt_bytes[i].data)
+        out.writelines(rows)
+    out.flush()
@@ -1,5 +1,11 @@
+import copy
+
+import numba
+import numpy as np
 import pytest
+from scipy.sparse import csr_matrix
 
+from hapsim_lite import generate
 from hapsim_lite.generate import HaplotypeGenerator
 from hapsim_lite.population import PopulationData
 
@@ -22,6 +28,22 @@ def test_reverse_pass(pop_data):
     hap.reverse_pass()
     assert hap.hap_matrix.shape == (2, 5)
 
+@pytest.mark.parametrize("direction", ["left", "both"])
+def test_markov_pass_matches_window_probs(pop_data, direction):
+    """The Markov-Chain kernel draws each variant from get_prob_in_window on the
+    current haplotypes, including values drawn earlier in the same pass"""
+    hap = HaplotypeGenerator(pop_data, 50, seed=42, window=2)
+    variants = np.array([1, 2, 3, 4, 3, 2, 1, 0])
+    uniforms = np.random.default_rng(7).random((50, len(variants)), dtype=np.float32)
+    walked = hap.hap_matrix.copy()
+    generate._markov_pass(
+        walked, uniforms, variants, *hap._get_window_terms(direction)
+    )
+    for j, i in enumerate(variants):
+        prob = hap.get_prob_in_window(i, hap._get_context(i, 2, direction))
+        hap.hap_matrix[:, i] = uniforms[:, j] < prob
+    assert (hap.hap_matrix == walked).all()
+
 def test__get_context(pop_data):
     """Ensure that context windows are properly calculated and do not under/overflow"""
     hap = HaplotypeGenerator(pop_data, 2)
@@ -42,4 +64,107 @@ def test_get_prob_in_window(pop_data):
     context = hap._get_context(4, 3, 'left')
     prob = hap.get_prob_in_window(4, context)
     assert prob.shape[0] == 2
-    assert prob[0] > 0.0
\ No newline at end of file
+    assert prob[0] > 0.0
+
+def test_block_pass(pop_data):
+    """Block pass doesn't alter the shape of the hap_matrix or crash"""
+    hap = HaplotypeGenerator(pop_data, 2)
+    hap.block_pass()
+    assert hap.hap_matrix.shape == (2, 5)
+    hap.block_pass("left")
+    assert hap.hap_matrix.shape == (2, 5)
+
+def test_block_pass_matches_window_probs(pop_data):
+    """Block pass resamples every variant from its window on the pre-pass haplotypes"""
+    hap = HaplotypeGenerator(pop_data, 50, seed=42)
+    probs = np.stack(
+        [hap.get_prob_in_window(i, hap._ctx_both[i], hap._w_both[i]) for i in range(5)],
+        axis=1,
+    )
+    uniforms = copy.deepcopy(hap._rng).random(hap.hap_matrix.shape, dtype=np.float32)
+    hap.block_pass()
+    assert (hap.hap_matrix == (uniforms < probs)).all()
+
+def test_cached_context(pop_data):
+    """Cached context arrays hold the same in-bounds neighbors as _get_context"""
+    hap = HaplotypeGenerator(pop_data, 2, window=3)
+    assert hap._ctx_left.shape == (5, 3)
+    assert hap._ctx_both.shape == (5, 6)
+    for i in range(5):
+        left = hap._ctx_left[i][hap._ctx_left_mask[i]]
+        assert left.tolist() == hap._get_context(i, 3, 'left')
+        both = hap._ctx_both[i][hap._ctx_both_mask[i]]
+        assert both.tolist() == hap._get_context(i, 3, 'both')
+
+def test_seed(pop_data):
+    """Generators with the same seed produce the same haplotypes"""
+    haps = []
+    for _ in range(2):
+        hap = HaplotypeGenerator(pop_data, 20, seed=42)
+        hap.forward_pass()
+        hap.reverse_pass()
+        haps.append(hap.hap_matrix)
+    assert (haps[0] == haps[1]).all()
+
+def test_get_prob_in_window_cached_weights(pop_data):
+    """Cached context and weights give the same probabilities as computing them per call"""
+    hap = HaplotypeGenerator(pop_data, 2)
+    prob = hap.get_prob_in_window(4, hap._get_context(4, 2, 'both'))
+    cached = hap.get_prob_in_window(4, hap._ctx_both[4], hap._w_both[4])
+    assert cached == pytest.approx(prob)
+
+def test_forward_pass_n_jobs(pop_data):
+    """Passes split across threads keep the shape and do not depend on n_jobs"""
+    haps = []
+    for n_jobs in [-1, 1, 2]:
+        hap = HaplotypeGenerator(pop_data, 20, seed=42, n_jobs=n_jobs)
+        hap.forward_pass()
+        hap.reverse_pass()
+        assert hap.hap_matrix.shape == (20, 5)
+        haps.append(hap.hap_matrix)
+    assert (haps[0] == haps[1]).all()
+    assert (haps[0] == haps[2]).all()
+
+@pytest.mark.parametrize("n_jobs", [-1, 1, 2])
+def test_markov_walk_threads(pop_data, monkeypatch, n_jobs):
+    """The kernel runs with n_jobs threads (capped at the Numba thread pool, so this
+    only exercises more than one thread when NUMBA_NUM_THREADS > 1), and the thread
+    count is restored after the pass"""
+    kernel_threads = []
+    markov_pass = generate._markov_pass
+
+    def record_threads(*args):
+        kernel_threads.append(numba.get_num_threads())
+        markov_pass(*args)
+
+    monkeypatch.setattr(generate, "_markov_pass", record_threads)
+    n_threads = numba.get_num_threads()
+    hap = HaplotypeGenerator(pop_data, 20, n_jobs=n_jobs)
+    hap.forward_pass()
+    max_threads = numba.config.NUMBA_NUM_THREADS
+    expected = max_threads if n_jobs == -1 else min(n_jobs, max_threads)
+    assert kernel_threads == [expected]
+    assert numba.get_num_threads() == n_threads
+
+@pytest.mark.parametrize("n_jobs", [0, -2])
+def test_n_jobs_invalid(pop_data, n_jobs):
+    """Thread counts below 1 other than -1 (all threads) are rejected"""
+    with pytest.raises(ValueError):
+        HaplotypeGenerator(pop_data, 2, n_jobs=n_jobs)
+
+def test_get_prob_in_window_saturated_ld():
+    """Variants in perfect LD floor 1 - P(a|b) at 1e-9, as the float64 model did"""
+    pop_data = PopulationData(
+        variant_index = {"1_1_A_G": 0, "1_2_C_T": 1},
+        variant_info = [("1", 1, "A", "G"), ("1", 2, "C", "T")],
+        positions = np.array([1, 2]),
+        mafs = np.array([0.3, 0.3], dtype = np.float32),
+        prob_matrix = csr_matrix(
+            ([0.3, 0.3], ([0, 1], [1, 0])), shape = (2, 2), dtype = np.float32),
+    )
+    hap = HaplotypeGenerator(pop_data, 2, tau=0.5, window=1)
+    hap.hap_matrix[:] = 1
+    # P(a|b) = 1, so lp1 = log(0.3) and lp0 = 0.5 * log(1e-9) + log(0.7)
+    expected = 1.0 / (1.0 + 0.7 / 0.3 * 1e-9 ** 0.5)
+    prob = hap.get_prob_in_window(1, hap._ctx_left[1], hap._w_left[1])
+    assert prob == pytest.approx(expected, rel=1e-6)
@@ -1,7 +1,91 @@
 import pytest
 
+import numpy as np
+
+from hapsim_lite.population import PopulationData
+
 from . import pop_data
 
+AFREQ = """#CHROM\tID\tREF\tALT\tALT_FREQS\tOBS_CT
+1\t1_10_A_G\tA\tG\t0.2\t100
+1\trs123\tC\tT\t0.3\t100
+1\t1_20_C_T\tC\tT\t0.4\t100
+1\t1_30_G_A\tG\tA\t0.1\t100
+"""
+
+VCOR = """#CHROM_A\tPOS_A\tID_A\tMAJ_A\tCHROM_B\tPOS_B\tID_B\tMAJ_B\tUNPHASED_R
+1\t10\t1_10_A_G\tA\t1\t20\t1_20_C_T\tC\t0.5
+1\t20\t1_20_C_T\tC\t1\t30\t1_30_G_A\tG\t-0.25
+1\t10\t1_10_A_G\tA\t1\t15\trs123\tC\t0.9
+"""
+
 def test_init(pop_data):
     """Population Data init without error and with expected variant index length"""
-    assert len(pop_data.variant_index) == 5
\ No newline at end of file
+    assert len(pop_data.variant_index) == 5
+
+def test_init_defaults():
+    """Attributes set by the parsers and build_prob_band default to None"""
+    pop_data = PopulationData()
+    assert pop_data.prob_band is None
+    assert pop_data.log_mafs is None
+    assert pop_data.log_1m_pa_given_ncs_band is None
+
+def test_build_prob_band(pop_data):
+    """Banded probabilities match the sparse matrix within the window and drop pairs outside it"""
+    pop_data.build_prob_band(2)
+    assert pop_data.prob_band.shape == (5, 5)
+    assert pop_data.prob_band[1, 3 - 1 + 2] == pytest.approx(0.9)
+    assert pop_data.prob_band[4, 2 - 4 + 2] == pytest.approx(0.1)
+    pop_data.build_prob_band(1)
+    assert not pop_data.prob_band.any()
+
+def test_from_plink2_afreq_vcor(tmp_path):
+    """Plink2 outputs are parsed into index-consistent arrays and a symmetric prob_matrix"""
+    (tmp_path / "FREQ.afreq").write_text(AFREQ)
+    (tmp_path / "LD.vcor").write_text(VCOR)
+    pop_data = PopulationData.from_plink2_afreq_vcor(
+        tmp_path / "FREQ.afreq", tmp_path / "LD.vcor")
+    assert pop_data.variant_index == {"1_10_A_G": 0, "1_20_C_T": 1, "1_30_G_A": 2}
+    assert pop_data.variant_info == [
+        ("1", 10, "A", "G"), ("1", 20, "C", "T"), ("1", 30, "G", "A")]
+    assert pop_data.contigs == {"1"}
+    assert pop_data.positions.tolist() == [10, 20, 30]
+    assert pop_data.mafs == pytest.approx([0.2, 0.4, 0.1])
+    expected = 0.2 * 0.4 + 0.5 * (0.2 * 0.8 * 0.4 * 0.6) ** 0.5
+    assert pop_data.prob_matrix[0, 1] == pytest.approx(expected)
+    assert pop_data.prob_matrix[1, 0] == pytest.approx(expected)
+    assert pop_data.prob_matrix[0, 2] == 0
+    # the pair with a variant missing from the afreq file is skipped
+    assert pop_data.prob_matrix.nnz == 4
+
+def test_from_plink2_afreq_unsorted(tmp_path):
+    """Unsorted plink2 inputs are rejected"""
+    (tmp_path / "FREQ.afreq").write_text(AFREQ.replace("1_30_G_A", "1_5_G_A"))
+    (tmp_path / "LD.vcor").write_text(VCOR)
+    with pytest.raises(ValueError):
+        PopulationData.from_plink2_afreq_vcor(
+            tmp_path / "FREQ.afreq", tmp_path / "LD.vcor")
+
+def test_build_prob_band_log_tables(pop_data):
+    """Banded log tables hold the conditional log probabilities of each in-band pair"""
+    pop_data.build_prob_band(2)
+    assert pop_data.log_mafs == pytest.approx(np.log(pop_data.mafs), rel=1e-5)
+    expected = pop_data.conditional_log_proba(
+        4, np.array([2]), np.array([0.1], dtype = np.float32))
+    band = (
+        pop_data.log_pa_given_cs_band,
+        pop_data.log_pa_given_ncs_band,
+        pop_data.log_1m_pa_given_cs_band,
+        pop_data.log_1m_pa_given_ncs_band,
+    )
+    for table, value in zip(band, expected):
+        assert table[4, 2 - 4 + 2] == pytest.approx(value[0], rel=1e-5)
+
+def test_from_plink2_afreq_no_valid_ids(tmp_path):
+    """afreq files without any chrom_pos_ref_alt IDs are rejected"""
+    (tmp_path / "FREQ.afreq").write_text(
+        "#CHROM\tID\tREF\tALT\tALT_FREQS\tOBS_CT\n1\t123\tA\tG\t0.2\t100\n")
+    (tmp_path / "LD.vcor").write_text(VCOR)
+    with pytest.raises(ValueError, match="chrom_pos_ref_alt"):
+        PopulationData.from_plink2_afreq_vcor(
+            tmp_path / "FREQ.afreq", tmp_path / "LD.vcor")
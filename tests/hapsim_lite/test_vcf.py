@@ -2,7 +2,10 @@ import pytest
 
 import numpy as np
 
-from hapsim_lite.vcf import generate_sample_ids, generate_call_matrix
+from hapsim_lite import vcf
+from hapsim_lite.vcf import generate_sample_ids, generate_call_matrix, write_vcf
+
+from . import pop_data
 
 def test_generate_sample_ids_length():
     """Sample ID generation creates the number expected"""
@@ -14,6 +17,11 @@ def test_generate_sample_ids_unique():
     sample_ids = set(generate_sample_ids(10000))
     assert len(sample_ids) == 10000
 
+def test_generate_sample_ids_seed():
+    """Sample IDs from the same seed are the same"""
+    assert generate_sample_ids(10, 42) == generate_sample_ids(10, 42)
+    assert generate_sample_ids(10, 42) != generate_sample_ids(10, 43)
+
 def test_generate_call_matrix_haploid():
     """String call matrix generates expected ploidy and number of calls"""
     haplotype_matrix = np.zeros((10, 10000), dtype = np.int8)
@@ -32,3 +40,58 @@ def test_generate_call_matrix_triploid():
     gt_matrix = generate_call_matrix(haplotype_matrix, 3, 5, False)
     assert gt_matrix.shape == (5, 10000)
 
+def test_generate_call_matrix_diploid_calls():
+    """Diploid calls pair consecutive haplotypes with the phased or unphased delimiter"""
+    haplotype_matrix = np.array([[1, 0], [0, 1], [1, 1], [0, 0]], dtype = np.int8)
+    gt_matrix = generate_call_matrix(haplotype_matrix, 2, 2, False)
+    assert gt_matrix.tolist() == [[b"1|0", b"0|1"], [b"1|0", b"1|0"]]
+    gt_matrix = generate_call_matrix(haplotype_matrix, 2, 2, True)
+    assert gt_matrix[0, 1] == b"0/1"
+
+def test_write_vcf(pop_data, capsysbinary):
+    """VCF rows hold the variant columns followed by one tab-separated call per sample"""
+    pop_data.contigs = {"1"}
+    haplotype_matrix = np.zeros((4, 5), dtype = np.int8)
+    haplotype_matrix[1, 2] = 1
+    gt_matrix = generate_call_matrix(haplotype_matrix, 2, 2, False)
+    write_vcf(gt_matrix, pop_data, ["a", "b"], chunk_size = 2)
+    lines = capsysbinary.readouterr().out.decode().splitlines()
+    assert lines[-6].endswith("FORMAT\ta\tb")
+    assert lines[-5:] == [
+        f"1\t{pos}\t1_{pos}_{ref}_{alt}\t{ref}\t{alt}\t.\t.\t.\tGT\t{gt}\t0|0"
+        for (_, pos, ref, alt), gt in zip(
+            pop_data.variant_info, ["0|0", "0|0", "0|1", "0|0", "0|0"]
+        )
+    ]
+
+def test_generate_call_matrix_haploid_triploid_calls():
+    """Haploid calls are single alleles and triploid calls join three consecutive haplotypes"""
+    haplotype_matrix = np.array([[1, 0], [0, 1], [1, 1]], dtype = np.int8)
+    gt_matrix = generate_call_matrix(haplotype_matrix, 1, 3, False)
+    assert gt_matrix.tolist() == [[b"1", b"0"], [b"0", b"1"], [b"1", b"1"]]
+    gt_matrix = generate_call_matrix(haplotype_matrix, 3, 1, True)
+    assert gt_matrix.tolist() == [[b"1/0/1", b"0/1/1"]]
+
+def test_write_vcf_str_calls(pop_data, capsysbinary):
+    """str calls are written as the same bytes as byte calls and other dtypes are rejected"""
+    pop_data.contigs = {"1"}
+    gt_matrix = generate_call_matrix(np.zeros((4, 5), dtype = np.int8), 2, 2, False)
+    write_vcf(gt_matrix, pop_data, ["a", "b"])
+    expected = capsysbinary.readouterr().out
+    write_vcf(gt_matrix.astype(str), pop_data, ["a", "b"])
+    assert capsysbinary.readouterr().out == expected
+    with pytest.raises(ValueError):
+        write_vcf(np.zeros((2, 5), dtype = np.int8), pop_data, ["a", "b"])
+
+def test_write_vcf_chunk_bytes(pop_data, capsysbinary, monkeypatch):
+    """Chunks sized by the byte budget write the same rows as one chunk"""
+    pop_data.contigs = {"1"}
+    haplotype_matrix = np.zeros((4, 5), dtype = np.int8)
+    haplotype_matrix[1, 2] = 1
+    gt_matrix = generate_call_matrix(haplotype_matrix, 2, 2, False)
+    write_vcf(gt_matrix, pop_data, ["a", "b"], chunk_size = 5)
+    expected = capsysbinary.readouterr().out
+    # two samples of 3 byte calls (plus separators) per variant, so 2 variants per chunk
+    monkeypatch.setattr(vcf, "_CHUNK_BYTES", 17)
+    write_vcf(gt_matrix, pop_data, ["a", "b"])
+    assert capsysbinary.readouterr().out == expected